@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status, Header
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
@@ -7,7 +7,7 @@ import shutil
 import uuid
 from pathlib import Path
 
-from . import models, schemas, database
+from . import models, schemas, database, ratelimit
 from .database import SessionLocal, engine
 
 # Create database tables
@@ -15,6 +15,40 @@ models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Bug Tracker API")
 
+# Admission control (registered before CORS so 429 responses still get CORS headers)
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Rate limit bug submissions and admin password attempts before the body is read"""
+    client = ratelimit.client_id(request)
+
+    if request.method == "POST" and request.url.path == "/api/bugs":
+        key = f"submit:client:{client}"
+        wait = await ratelimit.take(key, ratelimit.SUBMIT_CLIENT_LIMIT)
+        if wait:
+            return ratelimit.too_many_requests(wait)
+        # Reject rather than queue when too many uploads are in flight
+        async with ratelimit.upload_slot() as slot:
+            if slot is None:
+                await ratelimit.refund(key, ratelimit.SUBMIT_CLIENT_LIMIT)
+                return ratelimit.too_many_requests(ratelimit.UPLOAD_RETRY_AFTER)
+            return await call_next(request)
+
+    if ratelimit.is_auth_attempt(request):
+        # Only failed password attempts count against the client. Peek first so
+        # a logged-in admin's concurrent requests don't spend tokens; failures
+        # are charged even into debt, so a concurrent burst of bad passwords
+        # still locks the client out for as long as the burst deserves.
+        key = f"auth:{client}"
+        wait = await ratelimit.peek(key, ratelimit.AUTH_FAILURE_LIMIT)
+        if wait:
+            return ratelimit.too_many_requests(wait)
+        response = await call_next(request)
+        if response.status_code == 403:
+            await ratelimit.charge(key, ratelimit.AUTH_FAILURE_LIMIT)
+        return response
+
+    return await call_next(request)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,6 +56,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # Admin password from env
@@ -290,6 +325,16 @@ async def create_bug(
     if severity not in ["Low", "Medium", "High", "Critical"]:
         raise HTTPException(status_code=400, detail="Invalid severity")
     
+    # Validate product before charging its bucket, so unknown IDs don't create buckets
+    if not db.query(models.Product).filter(models.Product.id == product_id).first():
+        raise HTTPException(status_code=400, detail="Invalid product")
+    
+    # Per-product limit. The form (screenshots included) has already been parsed
+    # by now, so this does not save upload I/O; the middleware checks do that.
+    wait = await ratelimit.take(f"submit:product:{product_id}", ratelimit.SUBMIT_PRODUCT_LIMIT)
+    if wait:
+        raise ratelimit.rate_limited(wait)
+    
     # Get default "OPEN" status (lowest order)
     default_status = db.query(models.Status).order_by(models.Status.order).first()
     if not default_status:
@@ -0,0 +1,350 @@
+"""Admission control: token-bucket rate limits and a global upload concurrency cap"""
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Limits are requests per minute; a bucket holds one minute's worth of burst.
+# Set a per-minute limit to 0 to disable it.
+SUBMIT_CLIENT_LIMIT = float(os.getenv("SUBMIT_CLIENT_LIMIT", "10"))
+SUBMIT_PRODUCT_LIMIT = float(os.getenv("SUBMIT_PRODUCT_LIMIT", "60"))
+AUTH_FAILURE_LIMIT = float(os.getenv("AUTH_FAILURE_LIMIT", "5"))
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "4"))
+# Number of reverse proxies in front of the app that append to X-Forwarded-For.
+# 0 means the header is ignored and the peer address is used.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Suggested wait when all upload slots are busy
+UPLOAD_RETRY_AFTER = 5
+# Upload slot lease (sqlite backend). Renewed while the request runs, so it
+# only bounds how long a slot held by a worker that died stays taken.
+UPLOAD_SLOT_TTL = int(os.getenv("UPLOAD_SLOT_TTL", "60"))
+# Buckets idle this long are full again and can be forgotten
+IDLE_BUCKET_TTL = 3600
+# Seconds between sweeps for idle buckets
+PRUNE_INTERVAL = 60
+# How long a worker waits for the SQLite write lock. Kept short so a contended
+# limiter sheds load instead of tying up threadpool threads.
+SQLITE_TIMEOUT = 1
+# Suggested wait when the limiter's shared state is unavailable
+UNAVAILABLE_RETRY_AFTER = 1
+
+
+def _refill(tokens, elapsed, rate, capacity):
+    return min(capacity, tokens + elapsed * rate)
+
+
+def _refill_and_take(tokens, elapsed, rate, capacity, cost, force):
+    """Refill a bucket and try to take `cost` tokens; return (tokens, wait seconds)
+
+    With `force` the tokens are taken even if that leaves the bucket in debt.
+    """
+    tokens = _refill(tokens, elapsed, rate, capacity)
+    if tokens >= cost:
+        return min(capacity, tokens - cost), 0.0
+    if force:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+def _wait_for_one(tokens, rate):
+    return 0.0 if tokens >= 1 else (1 - tokens) / rate
+
+
+class MemoryStore:
+    """Limiter state held in this process (single worker)"""
+
+    blocking = False
+    leases_expire = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+        self._last_prune = time.monotonic()
+
+    def take(self, key, rate, capacity, cost=1.0, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_prune >= PRUNE_INTERVAL:
+                self._last_prune = now
+                self._buckets = {
+                    k: v for k, v in self._buckets.items()
+                    if now - v[1] < IDLE_BUCKET_TTL
+                }
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = _refill_and_take(tokens, now - updated, rate, capacity, cost, force)
+            self._buckets[key] = (tokens, now)
+            return wait
+
+    def peek(self, key, rate, capacity):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            return _wait_for_one(_refill(tokens, now - updated, rate, capacity), rate)
+
+    def acquire_slot(self, name, limit, ttl):
+        with self._lock:
+            held = self._slots.setdefault(name, set())
+            if len(held) >= limit:
+                return None
+            token = uuid.uuid4().hex
+            held.add(token)
+            return token
+
+    def renew_slot(self, name, token, ttl):
+        pass
+
+    def release_slot(self, name, token):
+        with self._lock:
+            self._slots.get(name, set()).discard(token)
+
+
+class SQLiteStore:
+    """Limiter state shared between workers through a SQLite file"""
+
+    blocking = True
+    leases_expire = True
+
+    def __init__(self, path):
+        self.path = path
+        self._prune_lock = threading.Lock()
+        self._last_prune = time.time()
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_slots "
+                "(token TEXT PRIMARY KEY, name TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _prune_due(self, now):
+        # Called from threadpool threads, so the timestamp needs its own lock
+        with self._prune_lock:
+            if now - self._last_prune < PRUNE_INTERVAL:
+                return False
+            self._last_prune = now
+            return True
+
+    def take(self, key, rate, capacity, cost=1.0, force=False):
+        now = time.time()
+        with self._transaction() as conn:
+            if self._prune_due(now):
+                conn.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated < ?",
+                    (now - IDLE_BUCKET_TTL,),
+                )
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, wait = _refill_and_take(
+                tokens, max(0.0, now - updated), rate, capacity, cost, force
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            return wait
+
+    def peek(self, key, rate, capacity):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return 0.0
+        tokens, updated = row
+        return _wait_for_one(_refill(tokens, max(0.0, time.time() - updated), rate, capacity), rate)
+
+    def acquire_slot(self, name, limit, ttl):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_limit_slots WHERE expires_at < ?", (now,))
+            (held,) = conn.execute(
+                "SELECT COUNT(*) FROM rate_limit_slots WHERE name = ?", (name,)
+            ).fetchone()
+            if held >= limit:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO rate_limit_slots (token, name, expires_at) VALUES (?, ?, ?)",
+                (token, name, now + ttl),
+            )
+            return token
+
+    def renew_slot(self, name, token, ttl):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE rate_limit_slots SET expires_at = ? WHERE token = ?",
+                (time.time() + ttl, token),
+            )
+
+    def release_slot(self, name, token):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_limit_slots WHERE token = ?", (token,))
+
+
+def get_store():
+    """Pick the limiter backend; use sqlite when running more than one worker"""
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "sqlite":
+        return SQLiteStore(os.getenv("RATE_LIMIT_DB", "./ratelimit.db"))
+    return MemoryStore()
+
+
+store = get_store()
+
+
+def client_id(request: Request) -> str:
+    """Identify the caller by peer address, or by X-Forwarded-For behind trusted proxies"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS > 0 and forwarded:
+        # Each trusted proxy appends the address it saw, so the client is the
+        # right-most entry not added by our own proxies. Anything to its left
+        # was supplied by the client and cannot be trusted.
+        hops = [hop.strip() for hop in forwarded.split(",")]
+        return hops[max(0, len(hops) - TRUSTED_PROXY_HOPS)]
+    return request.client.host if request.client else "unknown"
+
+
+async def _call(fn, *args, fallback=None, **kwargs):
+    """Run a store method off the event loop if it blocks.
+
+    If the shared state is unavailable (e.g. the SQLite lock wait timed out),
+    log it and return `fallback`, so callers decide whether to fail open or closed.
+    """
+    try:
+        if store.blocking:
+            return await run_in_threadpool(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+    except sqlite3.OperationalError:
+        logger.exception("Rate limiter state unavailable")
+        return fallback
+
+
+async def take(key: str, per_minute: float, cost: float = 1.0) -> float:
+    """Charge a per-minute bucket; return seconds until it would allow the request
+
+    Fails closed: if the limiter state is unavailable the request is refused.
+    """
+    if per_minute <= 0:
+        return 0.0
+    return await _call(
+        store.take, key, per_minute / 60.0, per_minute, cost,
+        fallback=UNAVAILABLE_RETRY_AFTER,
+    )
+
+
+async def refund(key: str, per_minute: float):
+    """Give back a token taken by `take`"""
+    if per_minute > 0:
+        await _call(store.take, key, per_minute / 60.0, per_minute, -1.0)
+
+
+async def peek(key: str, per_minute: float) -> float:
+    """Like `take`, but without spending a token (also fails closed)"""
+    if per_minute <= 0:
+        return 0.0
+    return await _call(
+        store.peek, key, per_minute / 60.0, per_minute,
+        fallback=UNAVAILABLE_RETRY_AFTER,
+    )
+
+
+async def charge(key: str, per_minute: float):
+    """Spend a token after the fact, going into debt if the bucket is empty"""
+    if per_minute > 0:
+        await _call(store.take, key, per_minute / 60.0, per_minute, force=True)
+
+
+async def _renew_upload_slot(token: str):
+    while True:
+        await asyncio.sleep(UPLOAD_SLOT_TTL / 3)
+        # Keep renewing through errors; if this task died the lease would
+        # expire under a still-running upload
+        try:
+            await _call(store.renew_slot, "uploads", token, UPLOAD_SLOT_TTL)
+        except Exception:
+            logger.exception("Failed to renew upload slot lease")
+
+
+@asynccontextmanager
+async def upload_slot():
+    """Hold one of the global in-flight upload slots; yields None if all are busy"""
+    token = await _call(store.acquire_slot, "uploads", MAX_CONCURRENT_UPLOADS, UPLOAD_SLOT_TTL)
+    if token is None:
+        yield None
+        return
+    renewer = asyncio.create_task(_renew_upload_slot(token)) if store.leases_expire else None
+    try:
+        yield token
+    finally:
+        if renewer:
+            renewer.cancel()
+        # On failure the slot is freed when its lease expires
+        await _call(store.release_slot, "uploads", token)
+
+
+def is_auth_attempt(request: Request) -> bool:
+    """True if the request presents an admin password"""
+    return (
+        request.url.path == "/api/auth/validate"
+        or "x-admin-password" in request.headers
+        or "password" in request.query_params
+    )
+
+
+def retry_after_headers(wait: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(wait)))}
+
+
+def too_many_requests(wait: float) -> JSONResponse:
+    """429 response for use in middleware, where HTTPException is not handled"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please try again later"},
+        headers=retry_after_headers(wait),
+    )
+
+
+def rate_limited(wait: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please try again later",
+        headers=retry_after_headers(wait),
+    )
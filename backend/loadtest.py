@@ -0,0 +1,196 @@
+"""Flood POST /api/bugs and check that read endpoints stay responsive.
+
+WARNING: every accepted submission creates a real bug and writes its
+screenshot (1 MB by default) to the server's upload disk. Only run this
+against a local or disposable server, never production. It refuses to run
+without --yes; pass --cleanup with --admin-password to delete the bugs it
+created afterwards.
+
+Run against a live server, e.g.:
+    uvicorn app.main:app --port 8000
+    python loadtest.py --yes --cleanup --admin-password $ADMIN_PASSWORD
+
+Exits non-zero if the read probes' p95 latency exceeds --max-p95-ms or more
+than --max-failures probes fail.
+
+By default every flood thread shares this machine's address, so the server
+sees a single client. To simulate distinct clients, start the server with
+TRUSTED_PROXY_HOPS=1 (as if behind one proxy) and pass --forwarded; each
+thread then sends its own X-Forwarded-For address.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = b""
+    for name, value in fields.items():
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    for name, filename, content in files:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: image/png\r\n\r\n"
+        ).encode() + content + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def send(request, body=None):
+    """Return (status code, seconds taken); appends the response to `body` if given"""
+    start = time.perf_counter()
+    try:
+        with urlopen(request, timeout=30) as resp:
+            data = resp.read()
+            code = resp.status
+        if body is not None:
+            body.append(data)
+    except HTTPError as e:
+        code = e.code
+    except (OSError, HTTPException):
+        # Connection errors, timeouts and dropped connections, including
+        # those raised while reading the response
+        code = 0
+    return code, time.perf_counter() - start
+
+
+def flood(url, product_id, screenshot_kb, client, forwarded, stop, results, created):
+    """Submit bugs as one client until told to stop"""
+    body, content_type = encode_multipart(
+        {
+            "product_id": product_id,
+            "summary": "Load test",
+            "description": "Submitted by loadtest.py",
+            "severity": "Low",
+        },
+        [("screenshots", "crash.png", b"\0" * screenshot_kb * 1024)],
+    )
+    headers = {"Content-Type": content_type}
+    if forwarded:
+        headers["X-Forwarded-For"] = f"10.0.{client // 256}.{client % 256}"
+    while not stop.is_set():
+        response = []
+        code, _ = send(Request(f"{url}/api/bugs", data=body, headers=headers, method="POST"), response)
+        results.append(code)
+        if code == 200:
+            created.append(json.loads(response[0])["id"])
+
+
+def probe_admin(url, password, count):
+    """Send `count` concurrent authenticated requests, as the admin UI does"""
+    request = Request(f"{url}/api/admin/products", headers={"X-Admin-Password": password})
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return [code for code, _ in pool.map(send, [request] * count)]
+
+
+def cleanup(url, password, bug_ids):
+    """Delete the bugs (and screenshots) created by the flood"""
+    headers = {"X-Admin-Password": password}
+    failed = 0
+    for bug_id in bug_ids:
+        code, _ = send(Request(f"{url}/api/bugs/{bug_id}", headers=headers, method="DELETE"))
+        if code != 200:
+            failed += 1
+    print(f"Cleanup: deleted {len(bug_ids) - failed} of {len(bug_ids)} bugs")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(args):
+    url = args.url.rstrip("/")
+    with urlopen(f"{url}/api/products", timeout=30) as resp:
+        products = json.load(resp)
+    if not products:
+        raise SystemExit("No products found, run seed.py first")
+
+    stop = threading.Event()
+    submissions = []
+    created = []
+    latencies = []
+    failures = 0
+
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for client in range(args.clients):
+            pool.submit(
+                flood, url, products[0]["id"], args.screenshot_kb, client, args.forwarded,
+                stop, submissions, created,
+            )
+
+        # Probe read endpoints while the flood is running
+        deadline = time.time() + args.seconds
+        try:
+            while time.time() < deadline:
+                for path in ("/api/products", "/api/statuses", "/api/bugs?limit=5"):
+                    code, elapsed = send(Request(f"{url}{path}"))
+                    if code != 200:
+                        failures += 1
+                    latencies.append(elapsed)
+                # A logged-in admin's concurrent requests must never be rate limited
+                if args.admin_password:
+                    failures += sum(code != 200 for code in probe_admin(url, args.admin_password, 10))
+                time.sleep(0.1)
+        finally:
+            # Always release the flood threads, or the executor waits on them forever
+            stop.set()
+
+    print(f"Submissions: {len(submissions)}")
+    for code in sorted(set(submissions)):
+        print(f"  {code}: {submissions.count(code)}")
+    print(f"Read probes: {len(latencies)} ({failures} failed)")
+    print(f"  p50: {percentile(latencies, 50) * 1000:.0f} ms")
+    print(f"  p95: {percentile(latencies, 95) * 1000:.0f} ms")
+    print(f"  max: {max(latencies) * 1000:.0f} ms")
+
+    if args.cleanup:
+        cleanup(url, args.admin_password, created)
+    elif created:
+        print(f"Left {len(created)} load test bugs on the server (use --cleanup to delete them)")
+
+    p95_ms = percentile(latencies, 95) * 1000
+    if p95_ms > args.max_p95_ms or failures > args.max_failures:
+        print(f"FAIL: p95 {p95_ms:.0f} ms (max {args.max_p95_ms}), "
+              f"{failures} failed probes (max {args.max_failures})")
+        return 1
+    print("PASS")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--seconds", type=int, default=15)
+    parser.add_argument("--screenshot-kb", type=int, default=1024)
+    parser.add_argument("--forwarded", action="store_true",
+                        help="give each thread its own X-Forwarded-For (server needs TRUSTED_PROXY_HOPS=1)")
+    parser.add_argument("--admin-password",
+                        help="also check that concurrent authenticated admin requests are not limited")
+    parser.add_argument("--cleanup", action="store_true",
+                        help="delete the created bugs afterwards (needs --admin-password)")
+    parser.add_argument("--max-p95-ms", type=float, default=1000)
+    parser.add_argument("--max-failures", type=int, default=0)
+    parser.add_argument("--yes", action="store_true",
+                        help="confirm the target server may be filled with test bugs and screenshots")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this creates real bugs and screenshot files on the server; "
+                     "pass --yes to confirm it is not production")
+    if args.cleanup and not args.admin_password:
+        parser.error("--cleanup needs --admin-password")
+    sys.exit(run(args))